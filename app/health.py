@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+# Keep-alive / health checks. Nothing here touches the DB pool or JSON
+# encoding: Render hits these every few minutes.
+router = APIRouter()
+
+
+@router.get("/healthz", response_class=PlainTextResponse)
+def health():
+    return "ok"
+
+
+@router.api_route("/ping", methods=["GET", "HEAD"], response_class=PlainTextResponse)
+def ping():
+    return "alive"
@@ -1,20 +1,285 @@
+import asyncio
+import logging
 import os
+import secrets
+from contextlib import asynccontextmanager
 from datetime import date
-from fastapi import FastAPI, HTTPException
+from itertools import combinations
+from urllib.parse import urlparse
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.decorator import cache
 from pydantic import BaseModel
-import psycopg2
-import psycopg2.extras
+from redis import asyncio as aioredis
+import asyncpg
+
+from app.health import router as health_router
 
 # Render / Supabase connection
 DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise RuntimeError("DATABASE_URL env var not set")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Supabase's PgBouncer pooler runs transaction mode on port 6543. Prepared
+# statements don't survive across its server connections, so asyncpg's
+# statement cache has to be off there.
+try:
+    _dsn_port = urlparse(DATABASE_URL).port
+except ValueError:
+    # Multi-host DSNs (h1:5432,h2:6543) have no single port to go by
+    _dsn_port = None
+DB_TRANSACTION_POOLING = os.getenv(
+    "DB_TRANSACTION_POOLING",
+    "true" if _dsn_port == 6543 else "false",
+).lower() == "true"
+
+# Shared secret for the write side of /refresh (X-Refresh-Token); unset
+# leaves /refresh a plain acknowledgement
+REFRESH_TOKEN = os.getenv("REFRESH_TOKEN")
+
+# Supabase drops idle sessions; ping the pool so they never go idle that long
+DB_KEEPALIVE_INTERVAL = 30
+
+# Response cache (falls back to per-process memory when no Redis is configured)
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_PREFIX = "macro"
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------
+# SQL
+# ---------------------------------------------------------
+# Kept as constants so every call sends identical text and hits asyncpg's
+# per-connection prepared statement cache (when it is enabled).
+
+SQL_GET_SERIES = """
+    SELECT json_build_object(
+        'id', i.id,
+        'title', i.title,
+        'description', i.description,
+        'unit', m.unit_display,
+        'source', m.source,
+        'latest', CASE WHEN $2 AND s.series_id IS NOT NULL THEN json_build_object(
+            'date', s.latest_date,
+            'value', s.latest_value
+        ) END,
+        'recent', CASE WHEN $3 THEN coalesce(s.recent, '[]') END,
+        'full', CASE WHEN $4 THEN coalesce((
+            SELECT json_agg(
+                json_build_object('date', o.date, 'value', o.value::float8)
+                ORDER BY o.date
+            )
+            FROM public.observations o
+            WHERE o.series_id = i.id
+        ), '[]') END,
+        'metadata', CASE WHEN m.id IS NULL THEN '{}'::json ELSE json_build_object(
+            'category', m.category,
+            'frequency', m.frequency,
+            'unit_display', m.unit_display,
+            'source', m.source,
+            'source_url', m.source_url,
+            'methodology_url', m.methodology_url,
+            'release_schedule', m.release_schedule,
+            'country', m.country,
+            'display_priority', m.display_priority,
+            'decimal_places', m.decimal_places
+        ) END
+    )::text
+    FROM public.indicators i
+    LEFT JOIN public.indicator_metadata m ON m.id = i.id
+    LEFT JOIN public.indicator_snapshot s ON s.series_id = i.id
+    WHERE i.id = $1
+"""
+
+# Same key indicator_snapshot_rebuild() locks on, so a refresh also backs
+# off while an ingest of that series is in flight
+SQL_TRY_SERIES_LOCK = """
+    SELECT pg_try_advisory_xact_lock(hashtext($1))
+"""
+
+SQL_REBUILD_SNAPSHOT = """
+    SELECT public.indicator_snapshot_rebuild(ARRAY[$1::text])
+"""
+
+SQL_INDICATOR_EXISTS = """
+    SELECT 1 FROM public.indicators WHERE id = $1
+"""
+
+SQL_EXPORT_OBSERVATIONS = """
+    SELECT date, value::float8 AS value
+    FROM public.observations
+    WHERE series_id = $1
+    ORDER BY date
+"""
+
+# Changes whenever any indicator or metadata row changes
+SQL_INDICATORS_VERSION = """
+    SELECT md5(
+        coalesce((
+            SELECT string_agg(i::text, ',' ORDER BY i.id)
+            FROM public.indicators i
+        ), '')
+        || coalesce((
+            SELECT string_agg(m::text, ',' ORDER BY m.id)
+            FROM public.indicator_metadata m
+        ), '')
+    )
+"""
+
+SQL_LIST_INDICATORS = """
+    SELECT coalesce(json_agg(
+        json_build_object(
+            'id', i.id,
+            'title', i.title,
+            'description', i.description,
+            'metadata', json_build_object(
+                'category', m.category,
+                'frequency', m.frequency,
+                'unit_display', m.unit_display,
+                'source', m.source,
+                'source_url', m.source_url,
+                'release_schedule', m.release_schedule,
+                'country', m.country,
+                'display_priority', m.display_priority,
+                'decimal_places', m.decimal_places
+            )
+        )
+        ORDER BY m.display_priority NULLS LAST, i.id
+    ), '[]')::text
+    FROM public.indicators i
+    LEFT JOIN public.indicator_metadata m ON i.id = m.id
+"""
+
+
+async def keepalive(pool):
+    # Concurrent pings check out distinct connections, so the whole min_size
+    # set stays warm; a dead connection fails here and is replaced by the
+    # pool instead of failing the first request after an idle spell
+    while True:
+        await asyncio.sleep(DB_KEEPALIVE_INTERVAL)
+        results = await asyncio.gather(
+            *(pool.execute("SELECT 1") for _ in range(DB_POOL_MIN_SIZE)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("DB keepalive failed: %r", result)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pool per process: connections (TCP + TLS) are reused across requests
+    server_settings = {"application_name": "macroradar"}
+    if not DB_TRANSACTION_POOLING:
+        # PgBouncer rejects startup parameters it doesn't track
+        server_settings["tcp_keepalives_idle"] = "60"
+
+    app.state.pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=30,
+        statement_cache_size=0 if DB_TRANSACTION_POOLING else 100,
+        max_cached_statement_lifetime=0,
+        server_settings=server_settings,
+    )
+    keepalive_task = asyncio.create_task(keepalive(app.state.pool))
+
+    if REDIS_URL:
+        backend = RedisBackend(aioredis.from_url(REDIS_URL))
+    else:
+        backend = InMemoryBackend()
+    FastAPICache.init(backend, prefix=CACHE_PREFIX)
+
+    try:
+        yield
+    finally:
+        keepalive_task.cancel()
+        await app.state.pool.close()
+
 
-app = FastAPI(title="MacroBiscuit API", version="0.4")
+app = FastAPI(
+    title="MacroBiscuit API",
+    version="0.4",
+    lifespan=lifespan,
+)
 
+# Timeseries JSON (repeated keys, monotonic dates) compresses very well
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
-def get_conn():
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL env var not set")
-    return psycopg2.connect(DATABASE_URL)
+
+class RawJSONCoder(Coder):
+    # Cache pre-serialized JSON responses byte-for-byte (no decode/re-encode)
+    @classmethod
+    def encode(cls, value):
+        return value.body
+
+    @classmethod
+    def decode(cls, value):
+        return Response(content=value, media_type="application/json")
+
+
+# Timeseries sections a client can ask /series/{series_id} for
+SERIES_SECTIONS = ("latest", "recent", "full")
+
+
+def parse_include(include: str) -> set[str]:
+    sections = {s.strip() for s in include.split(",") if s.strip()}
+    unknown = sections - set(SERIES_SECTIONS)
+    if unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown include value(s): {', '.join(sorted(unknown))}",
+        )
+    return sections
+
+
+def series_cache_key(namespace, series_id, sections):
+    return f"{namespace}:{series_id}:{','.join(sorted(sections))}"
+
+
+def series_key_builder(func, namespace="", *, request=None, response=None,
+                       args=(), kwargs=None):
+    return series_cache_key(
+        namespace, kwargs["series_id"], parse_include(kwargs["include"])
+    )
+
+
+async def evict_series(series_id):
+    # Delete the exact key of every include variant (8 of them). Pattern
+    # clears are avoided: the Redis backend splices the namespace into a Lua
+    # KEYS script, and series_id comes straight from the URL.
+    backend = FastAPICache.get_backend()
+    namespace = f"{FastAPICache.get_prefix()}:series"
+    keys = [
+        series_cache_key(namespace, series_id, sections)
+        for n in range(len(SERIES_SECTIONS) + 1)
+        for sections in combinations(SERIES_SECTIONS, n)
+    ]
+    # Entries expire on their own, so a cache outage must not fail the
+    # caller; log like fastapi-cache does for its own backend errors
+    try:
+        if isinstance(backend, RedisBackend):
+            await backend.redis.delete(*keys)
+        else:
+            for key in keys:
+                try:
+                    await backend.clear(key=key)
+                except KeyError:
+                    # InMemoryBackend raises for keys it doesn't hold
+                    pass
+    except Exception:
+        logger.warning("Evicting cached series %r failed", series_id,
+                       exc_info=True)
 
 
 # ---------------------------------------------------------
@@ -30,14 +295,7 @@ class Observation(BaseModel):
 # Health + Ping
 # ---------------------------------------------------------
 
-@app.get("/healthz")
-def health():
-    return {"ok": True}
-
-
-@app.api_route("/ping", methods=["GET", "HEAD"])
-def ping():
-    return {"status": "alive"}
+app.include_router(health_router)
 
 
 # ---------------------------------------------------------
@@ -45,135 +303,199 @@ def ping():
 # ---------------------------------------------------------
 
 @app.get("/series/{series_id}")
-def get_series(series_id: str):
-    conn = get_conn()
-    try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-
-            # --- Get title + description (canonical)
-            cur.execute("""
-                SELECT title, description 
-                FROM public.indicators
-                WHERE id = %s
-            """, (series_id,))
-            base = cur.fetchone()
-
-            if not base:
-                raise HTTPException(status_code=404, detail="Indicator not found")
-
-            # --- Get metadata
-            cur.execute("""
-                SELECT 
-                    category,
-                    frequency,
-                    unit_display,
-                    source,
-                    source_url,
-                    methodology_url,
-                    release_schedule,
-                    country,
-                    display_priority,
-                    decimal_places
-                FROM public.indicator_metadata
-                WHERE id = %s
-            """, (series_id,))
-            meta = cur.fetchone()
-
-            metadata = dict(meta) if meta else {}
-
-            # --- Get full timeseries
-            cur.execute("""
-                SELECT date, value
-                FROM public.observations
-                WHERE series_id = %s
-                ORDER BY date ASC
-            """, (series_id,))
-            rows = cur.fetchall()
-
-            full = [{"date": r["date"], "value": float(r["value"])} for r in rows]
-            latest = full[-1] if full else None
-            recent = full[-120:] if len(full) > 120 else full
-
-            return {
-                "id": series_id,
-                "title": base["title"],
-                "description": base["description"],
-                "unit": metadata.get("unit_display"),
-                "source": metadata.get("source"),
-                "latest": latest,
-                "recent": recent,
-                "full": full,
-                "metadata": metadata,
-            }
+@cache(expire=300, namespace="series", key_builder=series_key_builder,
+       coder=RawJSONCoder)
+async def get_series(
+    series_id: str,
+    include: str = Query(",".join(SERIES_SECTIONS)),
+):
+    sections = parse_include(include)
+
+    async with app.state.pool.acquire() as conn:
+
+        # --- Whole response body built as JSON by Postgres in one round-trip.
+        # latest/recent come from indicator_snapshot (kept current by
+        # triggers on observations); only "full" reads observations.
+        # Sections that were not requested come back as null.
+        body = await conn.fetchval(
+            SQL_GET_SERIES, series_id,
+            "latest" in sections, "recent" in sections, "full" in sections,
+        )
+
+    if body is None:
+        raise HTTPException(status_code=404, detail="Indicator not found")
 
+    return Response(content=body, media_type="application/json")
+
+
+# ---------------------------------------------------------
+# Bulk export (binary COPY)
+# ---------------------------------------------------------
+
+# Exports can outlive command_timeout when the client reads slowly
+EXPORT_TIMEOUT = 300
+
+# Each export holds a pool connection for as long as its client reads, so
+# cap them well below the pool size; slow downloads must not starve the API
+EXPORT_MAX_CONCURRENT = int(
+    os.getenv("EXPORT_MAX_CONCURRENT", str(max(1, DB_POOL_MAX_SIZE // 4)))
+)
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+class ExportResponse(StreamingResponse):
+    # Holds an export slot until the response is finished or aborted. The
+    # release lives here rather than in the body generator because a
+    # generator that never started (client gone before the first chunk)
+    # never runs its finally.
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            export_slots.release()
+
+
+async def stream_copy(pool, query, *args):
+    # COPY writes into a bounded queue from a background task; the response
+    # drains it, so a slow client applies backpressure to the COPY itself.
+    queue = asyncio.Queue(maxsize=16)
+
+    async def produce():
+        # Errors are handed to the consumer; cancellation (client went away)
+        # just ends the task
+        try:
+            async with pool.acquire() as conn:
+                await conn.copy_from_query(
+                    query, *args,
+                    output=queue.put, format="binary", timeout=EXPORT_TIMEOUT,
+                )
+        except Exception as exc:
+            await queue.put(exc)
+        else:
+            await queue.put(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (chunk := await queue.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            # asyncpg hands out bytearray; Starlette only accepts bytes/str
+            yield bytes(chunk)
     finally:
-        conn.close()
+        task.cancel()
+
+
+@app.get("/series/{series_id}/export")
+async def export_series(series_id: str):
+    async with app.state.pool.acquire() as conn:
+        exists = await conn.fetchval(SQL_INDICATOR_EXISTS, series_id)
+
+    if not exists:
+        raise HTTPException(status_code=404, detail="Indicator not found")
+
+    # Fail fast rather than queue behind stalled downloads
+    if export_slots.locked():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many exports in progress, retry later",
+            headers={"Retry-After": "30"},
+        )
+    await export_slots.acquire()
+
+    return ExportResponse(
+        stream_copy(app.state.pool, SQL_EXPORT_OBSERVATIONS, series_id),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="{series_id}.pgcopy"'
+        },
+    )
 
 
 # ---------------------------------------------------------
 # List all indicators
 # ---------------------------------------------------------
 
-@app.get("/indicators")
-def list_indicators():
-    conn = get_conn()
-    try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-
-            cur.execute("""
-                SELECT 
-                    i.id,
-                    i.title,
-                    i.description,
-                    m.category,
-                    m.frequency,
-                    m.unit_display,
-                    m.source,
-                    m.source_url,
-                    m.release_schedule,
-                    m.country,
-                    m.display_priority,
-                    m.decimal_places
-                FROM public.indicators i
-                LEFT JOIN public.indicator_metadata m ON i.id = m.id
-                ORDER BY m.display_priority NULLS LAST, i.id
-            """)
-
-            rows = cur.fetchall()
-
-            result = []
-            for r in rows:
-                result.append({
-                    "id": r["id"],
-                    "title": r["title"],
-                    "description": r["description"],
-                    "metadata": {
-                        "category": r["category"],
-                        "frequency": r["frequency"],
-                        "unit_display": r["unit_display"],
-                        "source": r["source"],
-                        "source_url": r["source_url"],
-                        "release_schedule": r["release_schedule"],
-                        "country": r["country"],
-                        "display_priority": r["display_priority"],
-                        "decimal_places": r["decimal_places"],
-                    }
-                })
-
-            return result
+# (version, serialized body) of the last /indicators payload built
+_indicators_cache: tuple[str, bytes] | None = None
 
-    finally:
-        conn.close()
+
+@app.get("/indicators")
+async def list_indicators(request: Request):
+    global _indicators_cache
+
+    async with app.state.pool.acquire() as conn:
+        # Version first: if the data changes before the body is built, the
+        # next probe mismatches and rebuilds
+        version = await conn.fetchval(SQL_INDICATORS_VERSION)
+        if _indicators_cache is None or _indicators_cache[0] != version:
+            body = await conn.fetchval(SQL_LIST_INDICATORS)
+            _indicators_cache = (version, body.encode())
+        body = _indicators_cache[1]
+
+    # Weak: the gzip and identity bodies share it. If-None-Match uses weak
+    # comparison (RFC 9110), and proxies that compress weaken tags too.
+    etag = f'W/"{version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    if "*" in tags or f'"{version}"' in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag},
+    )
 
 
 # ---------------------------------------------------------
 # Manual refresh
 # ---------------------------------------------------------
 
-@app.get("/refresh/{series_id}")
+# A single series rebuild; anything slower means something is wrong
+REFRESH_TIMEOUT = 10
+
+
+@app.get("/refresh/{series_id}", deprecated=True)
 @app.post("/refresh/{series_id}")
-def refresh(series_id: str):
-    return {
+async def refresh(
+    series_id: str,
+    x_refresh_token: str | None = Header(None),
+):
+    ack = {
         "ok": True,
         "message": "Update data directly in Supabase (public.observations)."
     }
+
+    # Without a token this stays the original no-op acknowledgement
+    if x_refresh_token is None:
+        return ack
+    if not REFRESH_TOKEN or not secrets.compare_digest(
+        x_refresh_token.encode(), REFRESH_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid refresh token")
+
+    # Snapshots are maintained on write; this rebuilds one series' row as a
+    # repair path (e.g. after TRUNCATE) and drops its cached responses
+    async with app.state.pool.acquire() as conn:
+        exists = await conn.fetchval(SQL_INDICATOR_EXISTS, series_id)
+
+    if not exists:
+        raise HTTPException(status_code=404, detail="Indicator not found")
+
+    # Evict even if the rebuild fails, but only once the connection is back
+    # in the pool
+    try:
+        async with app.state.pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval(SQL_TRY_SERIES_LOCK, series_id):
+                    raise HTTPException(
+                        status_code=409, detail="Refresh already in progress"
+                    )
+                await conn.execute(
+                    SQL_REBUILD_SNAPSHOT, series_id, timeout=REFRESH_TIMEOUT
+                )
+    finally:
+        await evict_series(series_id)
+
+    return ack
@@ -0,0 +1,17 @@
+-- Serves the /series/{id} observation reads (WHERE series_id = $1 ORDER BY date)
+-- with an index-only scan: rows come back pre-sorted and value is read from
+-- the index, so there is no sort node and no heap fetch.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; run this
+-- file with psql in autocommit mode (no --single-transaction).
+--
+-- Verify afterwards:
+--   EXPLAIN (ANALYZE, BUFFERS)
+--   SELECT date, value FROM public.observations
+--   WHERE series_id = '<id>' ORDER BY date;
+-- should show "Index Only Scan using observations_series_date_idx".
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS observations_series_date_idx
+    ON public.observations (series_id, date) INCLUDE (value);
+
+ANALYZE public.observations;
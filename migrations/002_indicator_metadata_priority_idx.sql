@@ -0,0 +1,40 @@
+-- Planner support for the /indicators join of indicators and
+-- indicator_metadata:
+--   * an index on indicator_metadata (display_priority NULLS LAST, id) for
+--     callers that read metadata on its own in priority order. It cannot
+--     supply the /indicators order: that query sorts a LEFT JOIN from
+--     indicators inside json_agg(... ORDER BY ...), and the sort is cheap at
+--     this table size anyway.
+--   * hourly ANALYZE of both join inputs so bulk ingests don't leave the
+--     planner on stale row estimates
+--   * slow statement logging to catch plan regressions
+--
+-- Postgres has no join hints; fresh statistics are what keeps it on the
+-- hash join.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; run this
+-- file with psql in autocommit mode (no --single-transaction).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS indicator_metadata_priority_idx
+    ON public.indicator_metadata (display_priority NULLS LAST, id);
+
+ANALYZE public.indicators;
+ANALYZE public.indicator_metadata;
+
+CREATE EXTENSION IF NOT EXISTS pg_cron;
+
+-- Re-scheduling under the same name replaces the existing job
+SELECT cron.schedule(
+    'analyze-indicators',
+    '0 * * * *',
+    'ANALYZE public.indicators; ANALYZE public.indicator_metadata;'
+);
+
+DO $$
+BEGIN
+    EXECUTE format(
+        'ALTER DATABASE %I SET log_min_duration_statement = %L',
+        current_database(), '100ms'
+    );
+END
+$$;
@@ -0,0 +1,12 @@
+-- Block-range index on observation dates for date-window filters
+-- (WHERE date BETWEEN ...). Observations are appended roughly in date
+-- order, so each 32-page range covers a narrow span of dates and the index
+-- stays a few kilobytes. Per-series reads keep using the btree from 001.
+--
+-- If the table grows into tens of millions of rows, partitioning it by
+-- RANGE (date) per year is the next step.
+--
+-- Run outside a transaction block (CONCURRENTLY).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS observations_date_brin
+    ON public.observations USING BRIN (date) WITH (pages_per_range = 32);
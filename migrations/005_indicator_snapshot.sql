@@ -0,0 +1,130 @@
+-- Precomputed latest point and last-120 window per series, so the default
+-- /series/{id} read (latest + recent) is a single unique-index lookup
+-- instead of two scans of observations.
+--
+-- Kept current on write: statement-level triggers on observations rebuild
+-- the snapshot rows of every series a statement touched, in the same
+-- transaction, so readers never see a snapshot that disagrees with
+-- observations. Load data in multi-row statements (INSERT ... SELECT,
+-- COPY) -- each statement rebuilds each touched series once.
+-- TRUNCATE does not fire these triggers; rebuild afterwards with
+--   SELECT public.indicator_snapshot_rebuild(ARRAY(SELECT id::text FROM public.indicators));
+--
+-- Runs in one transaction with writes to observations blocked, so no row
+-- can land between the initial fill and the triggers going live.
+
+BEGIN;
+
+LOCK TABLE public.observations IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS public.indicator_snapshot AS
+SELECT
+    series_id,
+    max(date) AS latest_date,
+    (array_agg(value::float8 ORDER BY date DESC))[1] AS latest_value,
+    jsonb_agg(
+        jsonb_build_object('date', date, 'value', value::float8)
+        ORDER BY date
+    ) AS recent
+FROM (
+    SELECT
+        series_id,
+        date,
+        value,
+        row_number() OVER (PARTITION BY series_id ORDER BY date DESC) AS rn
+    FROM public.observations
+) s
+WHERE rn <= 120
+GROUP BY series_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS indicator_snapshot_series_id_idx
+    ON public.indicator_snapshot (series_id);
+
+CREATE OR REPLACE FUNCTION public.indicator_snapshot_rebuild(ids text[])
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Serialize writers per series (in a fixed order, so no deadlocks); the
+    -- statements below then see rows committed by whoever held the lock
+    PERFORM pg_advisory_xact_lock(hashtext(id))
+    FROM (SELECT DISTINCT unnest(ids) AS id ORDER BY 1) l;
+
+    DELETE FROM public.indicator_snapshot s
+    WHERE s.series_id = ANY(ids)
+      AND NOT EXISTS (
+          SELECT 1 FROM public.observations o WHERE o.series_id = s.series_id
+      );
+
+    INSERT INTO public.indicator_snapshot (series_id, latest_date, latest_value, recent)
+    SELECT
+        series_id,
+        max(date),
+        (array_agg(value::float8 ORDER BY date DESC))[1],
+        jsonb_agg(
+            jsonb_build_object('date', date, 'value', value::float8)
+            ORDER BY date
+        )
+    FROM (
+        SELECT
+            series_id,
+            date,
+            value,
+            row_number() OVER (PARTITION BY series_id ORDER BY date DESC) AS rn
+        FROM public.observations
+        WHERE series_id = ANY(ids)
+    ) s
+    WHERE rn <= 120
+    GROUP BY series_id
+    ON CONFLICT (series_id) DO UPDATE SET
+        latest_date = excluded.latest_date,
+        latest_value = excluded.latest_value,
+        recent = excluded.recent;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION public.observations_sync_snapshot()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.indicator_snapshot_rebuild(
+            ARRAY(SELECT series_id::text FROM new_rows)
+        );
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM public.indicator_snapshot_rebuild(
+            ARRAY(
+                SELECT series_id::text FROM new_rows
+                UNION
+                SELECT series_id::text FROM old_rows
+            )
+        );
+    ELSE
+        PERFORM public.indicator_snapshot_rebuild(
+            ARRAY(SELECT series_id::text FROM old_rows)
+        );
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS observations_snapshot_insert ON public.observations;
+CREATE TRIGGER observations_snapshot_insert
+    AFTER INSERT ON public.observations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.observations_sync_snapshot();
+
+DROP TRIGGER IF EXISTS observations_snapshot_update ON public.observations;
+CREATE TRIGGER observations_snapshot_update
+    AFTER UPDATE ON public.observations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.observations_sync_snapshot();
+
+DROP TRIGGER IF EXISTS observations_snapshot_delete ON public.observations;
+CREATE TRIGGER observations_snapshot_delete
+    AFTER DELETE ON public.observations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.observations_sync_snapshot();
+
+COMMIT;